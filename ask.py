@@ -3,35 +3,55 @@
 import os
 import sys
 import json
+import re
+import time
+import hashlib
 import sqlite3
 import importlib.util
+from itertools import islice
 from pathlib import Path
 from typing import List, Dict, Optional
+from collections.abc import Sequence
 from langchain_mistralai import ChatMistralAI
 from langchain_core.tools import tool
 
 class Ask:
-    def __init__(self, ai_code_name: str, model_name: str = "mistral-large-latest", temperature: float = 0.5):
+    def __init__(self, ai_code_name: str, model_name: str = "mistral-large-latest", temperature: float = 0.5,
+                 small_model_name: Optional[str] = None, short_prompt_length: int = 200):
         self.ai_code_name = ai_code_name.lower()
         self.conversation_directory = os.path.join(".", "conversations")
         self.extension_directory = os.path.expanduser("~/extensions")
         self.database_filename = os.path.join(".", "database.db")
-        self.conversation_filename = os.path.join(
-            self.conversation_directory,
-            f"{self.ai_code_name}.json"
-        )
+
+        # Branches share their common prefix with the parent branch.  Only
+        # the suffix after the fork point is stored in the branch file, and
+        # loaded branches are cached so switching only reads what differs.
+        self.branch = "main"
+        self.branch_info = {"main": (None, 0)}  # branch: (parent, fork_point)
+        self.branch_cache = {}
+        self.conversation_filename = self._branch_filename(self.branch)
 
         # Initialize LLM
         self.llm = ChatMistralAI(
             model=model_name,
             temperature=temperature
         )
+        self.small_llm = None
+        if small_model_name:
+            self.small_llm = ChatMistralAI(
+                model=small_model_name,
+                temperature=temperature
+            )
+        self.router = ModelRouter({}, short_prompt_length)
+        self.routing_log = []
+        self.assembler = MessageAssembler()
+        self.prefix_stability_log = []
 
         # Initialize tools and messages
         self.tools = []
         self.module_manager = ModuleManager()
         self.module_manager.import_all(self)
-        self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self._bind_tools()
         self.messages = []
 
         # Initialize conversation
@@ -51,6 +71,8 @@ class Ask:
         else:
             self.messages.insert(0, {"content": system_prompt, "role": "system"})
 
+        self.messages = Conversation(None, 0, self.messages)
+        self.branch_cache[self.branch] = self.messages
         self._save_conversation_to_disk()
 
     def ask(self, prompt: str) -> str:
@@ -60,6 +82,7 @@ class Ask:
 
         # give commands access
         context = {
+            "ai": self,
             "prompt": prompt,
             "conversation": self.messages,
             "skip_api_call": False,
@@ -79,47 +102,71 @@ class Ask:
         if context['skip_api_call']:
             return context['response']
 
-        self.messages.append({"content": context['prompt'], "role": "user"})
+        self._append_messages({"content": context['prompt'], "role": "user"})
         self._save_conversation_to_disk()
 
+        routing = []
+        round_index = 0
+        context_block = self._get_context_block()
         while True:
-            response = self.llm_with_tools.invoke(self.messages)
+            request = self.assembler.assemble(self.messages, context_block)
+            response, records = self.router.run(request, context['prompt'], round_index)
+            for record in records:
+                record["prefix_hit"] = self.assembler.check_prefix(record["tier"], request)
+            routing.extend(records)
 
-            if not (hasattr(response, 'additional_kwargs') and 'tool_calls' in response.additional_kwargs):
+            if not has_tool_calls(response):
                 break
 
             tool_calls = response.additional_kwargs['tool_calls']
             self._handle_tool_calls(tool_calls)
+            round_index += 1
 
-            # always update the system prompt in case it was changed
+            # always update the system prompt and context in case they were changed
             if self.messages[0]["role"] == "system":
                 self.messages[0]["content"] = self._get_system_prompt()
-
-        self.messages.append({"content": response.content, "role": "assistant"})
+            context_block = self._get_context_block()
+
+        self.routing_log.append(routing)
+        prefix_hits = sum(1 for r in routing if r["prefix_hit"])
+        self.prefix_stability_log.append({
+            "requests": len(routing),
+            "prefix_hits": prefix_hits,
+            "stability": prefix_hits / len(routing)
+        })
+        self._append_messages({"content": response.content, "role": "assistant"})
         self._save_conversation_to_disk()
 
         return response.content
 
+    def _bind_tools(self):
+        """Bind the current tools to every model tier"""
+        self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self.router.models = {"large": self.llm_with_tools}
+        if self.small_llm is not None:
+            self.router.models["small"] = self.small_llm.bind_tools(self.tools)
+
     def _get_system_prompt(self) -> str:
         """Get the current system prompt"""
         with sqlite3.connect(self.database_filename) as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT prompt FROM system_prompts WHERE ai_code_name = ? ORDER BY date_created DESC LIMIT 1", (self.ai_code_name,))
+            cursor.execute("SELECT prompt FROM system_prompts WHERE ai_code_name = ? ORDER BY date_created DESC, id DESC LIMIT 1", (self.ai_code_name,))
             prompt = cursor.fetchone()
             prompt = prompt[0] if prompt else "You are a self-modifying AI assistant."
 
-            table_descriptions = self._get_table_descriptions()
-            column_descriptions = self._get_column_descriptions()
-
-            return (
-                f"System prompt:\n\n"
-                f"{prompt}\n\n"
-                f"---\n\n"
-                f"Additional information external to the 'system prompt':\n\n"
-                f"Your code name is {self.ai_code_name}.\n\n"
-                f"Database table descriptions:\n{json.dumps(table_descriptions, indent=2)}\n\n"
-                f"Database column descriptions:\n{json.dumps(column_descriptions, indent=2)}"
-            )
+            return f"System prompt:\n\n{prompt}"
+
+    def _get_context_block(self) -> str:
+        """Get the information that is sent after the conversation"""
+        table_descriptions = self._get_table_descriptions()
+        column_descriptions = self._get_column_descriptions()
+
+        return (
+            f"Additional information external to the 'system prompt':\n\n"
+            f"Your code name is {self.ai_code_name}.\n\n"
+            f"Database table descriptions:\n{json.dumps(table_descriptions, indent=2, sort_keys=True)}\n\n"
+            f"Database column descriptions:\n{json.dumps(column_descriptions, indent=2, sort_keys=True)}"
+        )
 
     def _get_table_descriptions(self) -> List[Dict]:
         """Get database table descriptions"""
@@ -135,7 +182,7 @@ class Ask:
         # }
         with sqlite3.connect(self.database_filename) as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM table_metadata")
+            cursor.execute("SELECT * FROM table_metadata ORDER BY table_name")
             results = cursor.fetchall()
             if not results:
                 return []
@@ -162,8 +209,17 @@ class Ask:
         directory = os.path.dirname(self.conversation_filename)
         if directory and not os.path.exists(directory):
             os.makedirs(directory)
+        parent, fork_point = self.branch_info[self.branch]
         with open(self.conversation_filename, "w") as f:
-            json.dump(self.messages, f)
+            if parent is None:
+                json.dump(self.messages.suffix, f)
+            else:
+                json.dump({
+                    "parent": parent,
+                    "fork_point": fork_point,
+                    "parent_hash": self.messages.parent_hash,
+                    "messages": self.messages.suffix
+                }, f)
 
     def _load_conversation_from_disk(self) -> List[Dict]:
         """Load conversation from disk"""
@@ -171,10 +227,113 @@ class Ask:
             return json.load(f)
 
     def delete_conversation(self):
-        """Delete the current conversation"""
+        """Delete the current conversation and the branches forked from it"""
         if os.path.exists(self.conversation_filename):
             os.remove(self.conversation_filename)
 
+        for branch in self._dependent_branches(self.branch):
+            filename = self._branch_filename(branch)
+            if os.path.exists(filename):
+                os.remove(filename)
+            self.branch_cache.pop(branch, None)
+            self.branch_info.pop(branch, None)
+
+    def _dependent_branches(self, branch: str) -> List[str]:
+        """Get the branches saved on disk that were forked from a branch"""
+        children = {}
+        prefix = f"{self.ai_code_name}@"
+        if os.path.isdir(self.conversation_directory):
+            for filename in os.listdir(self.conversation_directory):
+                if not (filename.startswith(prefix) and filename.endswith(".json")):
+                    continue
+                try:
+                    with open(os.path.join(self.conversation_directory, filename), "r") as f:
+                        parent = json.load(f)["parent"]
+                except (OSError, KeyError, TypeError, json.JSONDecodeError):
+                    continue
+                children.setdefault(parent, []).append(filename[len(prefix):-len(".json")])
+
+        dependents = []
+        pending = [branch]
+        while pending:
+            for child in children.get(pending.pop(), []):
+                dependents.append(child)
+                pending.append(child)
+        return dependents
+
+    def _branch_filename(self, branch: str) -> str:
+        """Get the conversation filename of a branch"""
+        if branch == "main":
+            filename = f"{self.ai_code_name}.json"
+        else:
+            filename = f"{self.ai_code_name}@{branch}.json"
+        return os.path.join(self.conversation_directory, filename)
+
+    def _append_messages(self, *messages: Dict):
+        """Append messages to the current branch"""
+        self.messages.extend(messages)
+
+    def _load_branch(self, branch: str) -> List[Dict]:
+        """Load a branch, reading only the parts that are not cached"""
+        if branch in self.branch_cache:
+            return self.branch_cache[branch]
+
+        with open(self._branch_filename(branch), "r") as f:
+            data = json.load(f)
+
+        if branch == "main":
+            messages = Conversation(None, 0, data)
+        else:
+            parent = data["parent"]
+            fork_point = data["fork_point"]
+            parent_messages = self._load_branch(parent)
+            if fork_point > len(parent_messages):
+                raise ValueError(f"it was forked past the end of '{parent}'")
+            digest = parent_messages.prefix_digest(fork_point)
+            if digest.hexdigest() != data.get("parent_hash"):
+                raise ValueError(f"'{parent}' no longer matches the history it was forked from")
+            messages = Conversation(parent_messages, fork_point, data["messages"], digest)
+            self.branch_info[branch] = (parent, fork_point)
+
+        self.branch_cache[branch] = messages
+        return messages
+
+    def fork(self, branch: str) -> str:
+        """Create a new branch from the current conversation and switch to it"""
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", branch):
+            return f"Invalid branch name '{branch}'."
+        if branch in self.branch_info or os.path.exists(self._branch_filename(branch)):
+            return f"Branch '{branch}' already exists."
+
+        # the new branch refers to the current one for its prefix
+        parent = self.branch
+        self.branch_info[branch] = (parent, len(self.messages))
+        self.messages = Conversation(self.messages, len(self.messages), [])
+        self.branch_cache[branch] = self.messages
+        self.branch = branch
+        self.conversation_filename = self._branch_filename(branch)
+        self._save_conversation_to_disk()
+
+        return f"Forked branch '{branch}' from '{parent}'."
+
+    def checkout(self, branch: str) -> str:
+        """Switch to an existing branch"""
+        if branch == self.branch:
+            return f"Already on branch '{branch}'."
+
+        try:
+            messages = self._load_branch(branch)
+        except (FileNotFoundError, KeyError, json.JSONDecodeError):
+            return f"Branch '{branch}' not found."
+        except ValueError as e:
+            return f"Cannot load branch '{branch}': {e}."
+
+        self.branch = branch
+        self.conversation_filename = self._branch_filename(branch)
+        self.messages = messages
+
+        return f"Switched to branch '{branch}'."
+
     def _handle_tool_calls(self, tool_calls: List[Dict]):
         """Handle tool calls and append results to messages"""
         tool_call_requests = []
@@ -225,12 +384,171 @@ class Ask:
                     "tool_call_id": tool_call_id
                 })
 
-        self.messages.append({
+        self._append_messages({
             "role": "assistant",
             "content": "",
             "tool_calls": tool_call_requests
-        })
-        self.messages.extend(tool_call_results)
+        }, *tool_call_results)
+
+def has_tool_calls(response) -> bool:
+    return hasattr(response, 'additional_kwargs') and 'tool_calls' in response.additional_kwargs
+
+class ModelRouter:
+    """Chooses and invokes the model tier for each round of the tool loop
+
+    Tool-planning rounds and short prompts go to the "small" tier when one
+    is configured; long prompts start on the "large" tier.  When the small
+    tier answers instead of calling a tool after a tool round, or gives no
+    usable text, the "large" tier produces the answer instead.
+    """
+
+    def __init__(self, models: Dict, short_prompt_length: int = 200, clock=time.perf_counter):
+        self.models = models
+        self.short_prompt_length = short_prompt_length
+        self.clock = clock
+
+    def choose(self, prompt: str, round_index: int) -> str:
+        """Get the tier for a round"""
+        if "small" not in self.models:
+            return "large"
+        if round_index > 0 or len(prompt) <= self.short_prompt_length:
+            return "small"
+        return "large"
+
+    def should_escalate(self, tier: str, round_index: int, response) -> bool:
+        """Check if a response should be redone by the large tier"""
+        if tier == "large" or has_tool_calls(response):
+            return False
+        if round_index > 0:
+            return True
+        content = getattr(response, 'content', None)
+        return not (isinstance(content, str) and content.strip())
+
+    def run(self, messages: List[Dict], prompt: str, round_index: int):
+        """Invoke the tier for a round, escalating if needed
+
+        Returns the response and a record of each model call.
+        """
+        tier = self.choose(prompt, round_index)
+        response, record = self._invoke(tier, messages, round_index)
+        records = [record]
+
+        if self.should_escalate(tier, round_index, response):
+            response, record = self._invoke("large", messages, round_index, escalated=True)
+            records.append(record)
+
+        return response, records
+
+    def _invoke(self, tier: str, messages: List[Dict], round_index: int, escalated: bool = False):
+        start = self.clock()
+        response = self.models[tier].invoke(messages)
+        return response, {
+            "round": round_index,
+            "tier": tier,
+            "escalated": escalated,
+            "latency": self.clock() - start
+        }
+
+class Conversation(Sequence):
+    """Messages of a branch: a prefix of the parent plus its own suffix
+
+    The prefix is read through the parent chain and never copied, so
+    forking and loading a branch only cost as much as its own suffix.  A
+    running hash of the messages after the system prompt lets a branch
+    record, and later check, the prefix it was forked from.
+    """
+
+    def __init__(self, parent: Optional["Conversation"], fork_point: int, suffix: List[Dict],
+                 digest=None):
+        self.parent = parent
+        self.fork_point = fork_point
+        self.suffix = suffix
+
+        if digest is None:
+            digest = parent.prefix_digest(fork_point) if parent is not None else hashlib.sha256()
+        self.parent_hash = digest.hexdigest() if parent is not None else None
+        self.digest = digest
+        self._update_digest(suffix if parent is not None else suffix[1:])
+
+    def __len__(self) -> int:
+        return self.fork_point + len(self.suffix)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("conversation index out of range")
+        if index >= self.fork_point:
+            return self.suffix[index - self.fork_point]
+        return self.parent[index]
+
+    def __iter__(self):
+        if self.parent is not None:
+            yield from islice(self.parent, self.fork_point)
+        yield from self.suffix
+
+    def extend(self, messages: List[Dict]):
+        messages = list(messages)
+        self._update_digest(messages if len(self) > 0 else messages[1:])
+        self.suffix.extend(messages)
+
+    def prefix_digest(self, count: int):
+        """Get the hash of the first count messages, without the system prompt"""
+        if count == len(self):
+            return self.digest.copy()
+        digest = hashlib.sha256()
+        for message in islice(self, 1, count):
+            digest.update(serialize_message(message))
+        return digest
+
+    def _update_digest(self, messages: List[Dict]):
+        for message in messages:
+            self.digest.update(serialize_message(message))
+
+def serialize_message(message: Dict) -> bytes:
+    return (json.dumps(message, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+def prefix_hash(messages: List[Dict]) -> str:
+    serialized = json.dumps(messages, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+class MessageAssembler:
+    """Builds requests as a stable prefix followed by volatile context
+
+    Within a branch the conversation only grows, so each request starts
+    with the previous one and the provider can reuse its cached prefix.
+    Volatile context is appended to a copy of the last message, which is
+    always a user or tool message, and is never stored.
+    """
+
+    def __init__(self):
+        self.previous = {}  # tier: (message count, prefix hash)
+
+    def assemble(self, messages: List[Dict], context_block: str) -> List[Dict]:
+        """Get the messages to send for a request"""
+        request = list(messages)
+        last = dict(request[-1])
+        content = last["content"]
+        if not isinstance(content, str):
+            content = json.dumps(content)
+        last["content"] = f"{content}\n\n---\n\n{context_block}"
+        request[-1] = last
+        return request
+
+    def check_prefix(self, tier: str, request: List[Dict]) -> bool:
+        """Check if the previous request to a tier is a prefix of this one
+
+        The last message carries the volatile context, so it is left out
+        of the part that later requests are expected to repeat.
+        """
+        hit = False
+        if tier in self.previous:
+            count, digest = self.previous[tier]
+            hit = count <= len(request) and prefix_hash(request[:count]) == digest
+        self.previous[tier] = (len(request) - 1, prefix_hash(request[:-1]))
+        return hit
 
 class ModuleManager:
     """Singleton class to manage imported modules"""
@@ -260,7 +578,7 @@ class ModuleManager:
                     self.modules[module_name] = module
                     tool = getattr(module, module_name)
                     ask_instance.tools.append(tool)
-        ask_instance.llm_with_tools = ask_instance.llm.bind_tools(ask_instance.tools)
+        ask_instance._bind_tools()
 
 
 def get_multiline(txt):
@@ -298,9 +616,23 @@ def save_response(cmd, context):
     context['skip_api_call'] = True
     context['response'] = f"The file '{filename}' was saved successfully."
 
+def fork_conversation(cmd, context):
+    branch = context['prompt'][len(cmd):].strip()
+
+    context['skip_api_call'] = True
+    context['response'] = context['ai'].fork(branch)
+
+def checkout_conversation(cmd, context):
+    branch = context['prompt'][len(cmd):].strip()
+
+    context['skip_api_call'] = True
+    context['response'] = context['ai'].checkout(branch)
+
 commands = {
     "#file ": read_prompt_from_file,
-    "#save ": save_response
+    "#save ": save_response,
+    "#fork ": fork_conversation,
+    "#checkout ": checkout_conversation
 }
 
 ########################################################################
@@ -309,14 +641,17 @@ if __name__ == "__main__":
 
     ai_code_name = None
     input_method = get_single_line
-    ai = None
+    small_model_name = None
+    short_prompt_length = 200
+    new_conversation = False
+    usage = ("Usage: python ask.py <ai_code_name> [--multiline] [--new] "
+             "[--small-model <model_name>] [--short-prompt-length <characters>]")
 
     # go through all arguments one at a time
-    for i in range(1, len(sys.argv)):
-        arg = sys.argv[i]
+    args = iter(sys.argv[1:])
+    for arg in args:
         if ai_code_name is None:
             ai_code_name = arg
-            ai = Ask(ai_code_name)
             continue
 
         if arg == "--multiline":
@@ -324,13 +659,29 @@ if __name__ == "__main__":
             continue
 
         elif arg == "--new":
-            if ai is not None:
-                ai.delete_conversation()
+            new_conversation = True
+
+        elif arg == "--small-model":
+            small_model_name = next(args, None)
+            if small_model_name is None:
+                print(usage)
+                sys.exit(1)
+
+        elif arg == "--short-prompt-length":
+            value = next(args, "")
+            if not value.isdigit():
+                print(usage)
+                sys.exit(1)
+            short_prompt_length = int(value)
 
         else:
             print(f"Unknown argument: {arg}")
             sys.exit(1)
 
+    ai = Ask(ai_code_name, small_model_name=small_model_name, short_prompt_length=short_prompt_length)
+    if new_conversation:
+        ai.delete_conversation()
+
     while True:
         prompt = input_method("You: ")
         if len(prompt) == 0:
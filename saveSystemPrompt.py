@@ -1,31 +1,32 @@
 #!/usr/bin/env python
 
+import os
 import sqlite3
 import sys
+import hashlib
 from datetime import datetime
 import re
 
-def table_exists(db_path, table_name):
+def table_exists(conn, table_name):
     """
     Check if a table exists in the SQLite database.
     
     Args:
-        database_path (str): Path to the SQLite database file
+        conn (sqlite3.Connection): Open database connection
         table_name (str): Name of the table to check
     
     Returns:
         bool: True if table exists, False otherwise
     """
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-            return cursor.fetchone() is not None
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        return cursor.fetchone() is not None
     except sqlite3.Error as e:
         print(f"table_exists???  {e}", file=sys.stderr)
         return False
 
-def create_database(db_path):
+def create_database(conn):
     """Create the SQLite database and table structure."""
 
     cmds = [
@@ -135,16 +136,71 @@ def create_database(db_path):
     ]
 
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            for sql in cmds:
-                cursor.execute(sql)
-            conn.commit()
+        cursor = conn.cursor()
+        for sql in cmds:
+            cursor.execute(sql)
+        conn.commit()
     except sqlite3.Error as e:
         print(f"create_database???  {e}", file=sys.stderr)
         return False
     return True
 
+def migrate_database(conn):
+    """
+    Bring the database schema up to date.
+
+    The schema version is kept in PRAGMA user_version.  Version 1 adds a
+    content hash to system_prompts and an index for the latest prompt
+    lookup done by ask.py.
+    """
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+
+    try:
+        if version < 1:
+            cursor.execute("SELECT name FROM pragma_table_info('system_prompts')")
+            if "prompt_hash" not in [row[0] for row in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE system_prompts ADD COLUMN prompt_hash TEXT")
+
+            cursor.execute("SELECT id, prompt FROM system_prompts WHERE prompt_hash IS NULL")
+            cursor.executemany(
+                "UPDATE system_prompts SET prompt_hash = ? WHERE id = ?",
+                [(prompt_hash(prompt), id) for id, prompt in cursor.fetchall()]
+            )
+
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS system_prompts_ai_code_name_date_created "
+                "ON system_prompts (ai_code_name, date_created)"
+            )
+            cursor.execute(
+                "INSERT OR IGNORE INTO column_metadata (table_name, "
+                "column_name, data_type, description) "
+                "VALUES('system_prompts','prompt_hash','TEXT','SHA-256 of "
+                "the prompt text, used to skip unchanged prompts')"
+            )
+            cursor.execute("PRAGMA user_version = 1")
+
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"migrate_database???  {e}", file=sys.stderr)
+        return False
+    return True
+
+def open_database(db_path):
+    """Open the database, creating and migrating it as needed."""
+    conn = sqlite3.connect(db_path)
+    if not table_exists(conn, "ask_config"):
+        create_database(conn)
+    if not migrate_database(conn):
+        conn.close()
+        return None
+    return conn
+
+def prompt_hash(system_prompt):
+    return hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+
 def load_system_prompt(filename):
     try:
         # Read the markdown file
@@ -155,42 +211,99 @@ def load_system_prompt(filename):
         print(f"Error: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
-def save_system_prompt(db_path, ai_code_name, system_prompt):
-
-    sql = """
-        INSERT INTO system_prompts (
-            ai_code_name,
-            prompt
-        ) VALUES (
-            ?, ?
+INSERT_SYSTEM_PROMPT_SQL = """
+    INSERT INTO system_prompts (
+        ai_code_name,
+        prompt,
+        prompt_hash
+    ) VALUES (
+        ?, ?, ?
+    )
+"""
+
+def save_system_prompt(conn, ai_code_name, system_prompt):
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            INSERT_SYSTEM_PROMPT_SQL,
+            (ai_code_name, system_prompt, prompt_hash(system_prompt))
         )
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"save_system_prompt:  {e}", file=sys.stderr)
+        return False
+    return True
+
+def import_system_prompts(conn, directory):
     """
+    Import every prompt file in a directory in a single transaction.
+
+    The file name without its extension is used as the AI code name, in
+    lower case to match ask.py.  A prompt is skipped when it is identical
+    to the newest prompt already stored for that code name.
+
+    Returns:
+        tuple: (imported, skipped) counts, or None on error
+    """
+    imported = 0
+    skipped = 0
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
+        cursor = conn.cursor()
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+
+            ai_code_name = os.path.splitext(filename)[0].lower()
+            system_prompt = load_system_prompt(path)
+            content_hash = prompt_hash(system_prompt)
+
             cursor.execute(
-                sql,
-                (ai_code_name, system_prompt)
+                "SELECT prompt_hash FROM system_prompts WHERE ai_code_name = ? "
+                "ORDER BY date_created DESC, id DESC LIMIT 1",
+                (ai_code_name,)
             )
-            conn.commit()
+            latest = cursor.fetchone()
+            if latest and latest[0] == content_hash:
+                skipped += 1
+                continue
+
+            cursor.execute(
+                INSERT_SYSTEM_PROMPT_SQL,
+                (ai_code_name, system_prompt, content_hash)
+            )
+            imported += 1
+        conn.commit()
     except sqlite3.Error as e:
-        print(f"save_system_prompt:  {e}", file=sys.stderr)
-        return False
-    return True
+        conn.rollback()
+        print(f"import_system_prompts:  {e}", file=sys.stderr)
+        return None
+    return imported, skipped
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
         print("Usage: python script.py <ai_code_name> <db_path> <input_file>")
+        print("       python script.py --bulk <db_path> <input_directory>")
         sys.exit(1)
     
     ai_code_name = sys.argv[1]
     db_path = sys.argv[2]
     input_file = sys.argv[3]
 
-    if not table_exists(db_path, "ask_config"):
-        create_database(db_path)
-
-    system_prompt = load_system_prompt(input_file)    
-    if not save_system_prompt(db_path, ai_code_name, system_prompt):
-        print("It didn't work", file=sys.stderr)
+    conn = open_database(db_path)
+    if conn is None:
         sys.exit(1)
+
+    with conn:
+        if ai_code_name == "--bulk":
+            counts = import_system_prompts(conn, input_file)
+            if counts is None:
+                print("It didn't work", file=sys.stderr)
+                sys.exit(1)
+            print(f"Imported {counts[0]} prompts, skipped {counts[1]} unchanged.")
+        else:
+            system_prompt = load_system_prompt(input_file)
+            if not save_system_prompt(conn, ai_code_name, system_prompt):
+                print("It didn't work", file=sys.stderr)
+                sys.exit(1)
+    conn.close()
@@ -0,0 +1,289 @@
+import os
+import sys
+import json
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# ask.py imports the provider SDK at module level; stand in for it when it
+# is not installed so the offline checks still run.
+try:
+    import langchain_mistralai
+    import langchain_core.tools
+except ImportError:
+    class StubChatMistralAI:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+        def bind_tools(self, tools):
+            return self
+
+    langchain_mistralai = types.ModuleType("langchain_mistralai")
+    langchain_mistralai.ChatMistralAI = StubChatMistralAI
+    langchain_core = types.ModuleType("langchain_core")
+    langchain_core.tools = types.ModuleType("langchain_core.tools")
+    langchain_core.tools.tool = lambda f: f
+    sys.modules["langchain_mistralai"] = langchain_mistralai
+    sys.modules["langchain_core"] = langchain_core
+    sys.modules["langchain_core.tools"] = langchain_core.tools
+
+from ask import Ask, Conversation, MessageAssembler, ModelRouter
+from saveSystemPrompt import open_database
+
+
+def user(content):
+    return {"role": "user", "content": content}
+
+
+def test_conversation_reads_through_two_parents():
+    root = Conversation(None, 0, [{"role": "system", "content": "s"}, user("a"), user("b")])
+    child = Conversation(root, 2, [user("c")])
+    grandchild = Conversation(child, 3, [user("d"), user("e")])
+    root.extend([user("root only")])
+
+    assert len(grandchild) == 5
+    assert [m["content"] for m in grandchild] == ["s", "a", "c", "d", "e"]
+    assert grandchild[1] is root[1]
+    assert grandchild[2]["content"] == "c"
+    assert grandchild[-1]["content"] == "e"
+    assert grandchild[-5]["content"] == "s"
+    assert [m["content"] for m in grandchild[1:4]] == ["a", "c", "d"]
+    assert [m["content"] for m in grandchild[::-2]] == ["e", "c", "s"]
+    with pytest.raises(IndexError):
+        grandchild[5]
+    with pytest.raises(IndexError):
+        grandchild[-6]
+
+
+def test_prefix_digest_ignores_system_prompt_and_matches_forks():
+    root = Conversation(None, 0, [{"role": "system", "content": "s"}, user("a")])
+    child = Conversation(root, 2, [])
+    root.extend([user("b")])
+
+    assert root.prefix_digest(2).hexdigest() == child.parent_hash
+    assert child.digest.hexdigest() == child.parent_hash
+    root[0]["content"] = "changed"
+    assert root.prefix_digest(2).hexdigest() == child.parent_hash
+
+
+@pytest.fixture
+def make_ask(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("MISTRAL_API_KEY", "offline")
+    (tmp_path / "extensions").mkdir()
+    open_database("database.db").close()
+    return lambda: Ask("bob")
+
+
+def contents(ai):
+    return [m["content"] for m in ai.messages][1:]
+
+
+def test_fork_and_checkout_round_trip(make_ask):
+    ai = make_ask()
+    ai._append_messages(user("one"), user("two"))
+    ai._save_conversation_to_disk()
+
+    assert ai.fork("alt") == "Forked branch 'alt' from 'main'."
+    ai._append_messages(user("on alt"))
+    ai._save_conversation_to_disk()
+    assert ai.fork("deeper") == "Forked branch 'deeper' from 'alt'."
+    ai._append_messages(user("on deeper"))
+    ai._save_conversation_to_disk()
+    assert ai.checkout("main") == "Switched to branch 'main'."
+    ai._append_messages(user("on main"))
+    ai._save_conversation_to_disk()
+
+    with open("conversations/bob@alt.json") as f:
+        saved = json.load(f)
+    assert saved["parent"] == "main"
+    assert saved["fork_point"] == 3
+    assert saved["messages"] == [user("on alt")]
+
+    ai = make_ask()
+    assert contents(ai) == ["one", "two", "on main"]
+    assert ai.checkout("deeper") == "Switched to branch 'deeper'."
+    assert contents(ai) == ["one", "two", "on alt", "on deeper"]
+    assert ai.checkout("alt") == "Switched to branch 'alt'."
+    assert contents(ai) == ["one", "two", "on alt"]
+    assert ai.checkout("missing") == "Branch 'missing' not found."
+    assert ai.fork("alt") == "Branch 'alt' already exists."
+
+
+def test_new_conversation_deletes_dependent_branches(make_ask):
+    ai = make_ask()
+    ai._append_messages(user("one"), user("two"))
+    ai._save_conversation_to_disk()
+    ai.fork("alt")
+    ai.fork("deeper")
+    ai.checkout("main")
+
+    ai.delete_conversation()
+
+    assert os.listdir("conversations") == []
+    ai = make_ask()
+    assert ai.checkout("alt") == "Branch 'alt' not found."
+
+
+def test_branch_with_changed_parent_is_refused(make_ask):
+    ai = make_ask()
+    ai._append_messages(user("one"), user("two"))
+    ai._save_conversation_to_disk()
+    ai.fork("alt")
+    ai._append_messages(user("on alt"))
+    ai._save_conversation_to_disk()
+
+    with open("conversations/bob.json", "w") as f:
+        json.dump([{"role": "system", "content": "s"}, user("other"), user("two")], f)
+    ai = make_ask()
+    assert ai.checkout("alt") == (
+        "Cannot load branch 'alt': 'main' no longer matches the history it was forked from."
+    )
+
+    with open("conversations/bob.json", "w") as f:
+        json.dump([{"role": "system", "content": "s"}], f)
+    ai = make_ask()
+    assert ai.checkout("alt") == "Cannot load branch 'alt': it was forked past the end of 'main'."
+    assert contents(ai) == []
+
+
+class FakeResponse:
+    def __init__(self, content, tool_calls=False):
+        self.content = content
+        self.additional_kwargs = {}
+        if tool_calls:
+            self.additional_kwargs["tool_calls"] = [
+                {"id": "1", "function": {"name": "list_files", "arguments": "{}"}}
+            ]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeModel:
+    def __init__(self, clock, delay, responses):
+        self.clock = clock
+        self.delay = delay
+        self.responses = list(responses)
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        self.clock.now += self.delay
+        return self.responses.pop(0)
+
+
+def make_router(small_responses, large_responses):
+    clock = FakeClock()
+    small = FakeModel(clock, 0.1, small_responses)
+    large = FakeModel(clock, 2.0, large_responses)
+    router = ModelRouter({"small": small, "large": large}, short_prompt_length=10, clock=clock)
+    return router, small, large
+
+
+def test_short_prompt_and_tool_planning_use_small_model():
+    router, small, large = make_router(
+        [FakeResponse("", tool_calls=True), FakeResponse("", tool_calls=True)], [])
+
+    response, records = router.run([], "hi", 0)
+    assert "tool_calls" in response.additional_kwargs
+    response, more = router.run([], "hi", 1)
+    records += more
+
+    assert "tool_calls" in response.additional_kwargs
+    assert [r["tier"] for r in records] == ["small", "small"]
+    assert len(large.calls) == 0
+
+
+def test_short_prompt_without_tools_is_answered_by_small_model():
+    router, small, large = make_router([FakeResponse("hello")], [])
+
+    response, records = router.run([], "hi", 0)
+
+    assert response.content == "hello"
+    assert [r["tier"] for r in records] == ["small"]
+
+
+def test_long_prompt_starts_on_large_model():
+    router, small, large = make_router([], [FakeResponse("answer")])
+
+    response, records = router.run([], "a much longer prompt", 0)
+
+    assert response.content == "answer"
+    assert [r["tier"] for r in records] == ["large"]
+    assert len(small.calls) == 0
+
+
+def test_final_answer_after_tool_round_comes_from_large_model():
+    router, small, large = make_router(
+        [FakeResponse("small answer")],
+        [FakeResponse("", tool_calls=True), FakeResponse("large answer")])
+
+    response, records = router.run([], "a much longer prompt", 0)
+    assert "tool_calls" in response.additional_kwargs
+    response, more = router.run([], "a much longer prompt", 1)
+    records += more
+
+    assert response.content == "large answer"
+    assert [(r["round"], r["tier"], r["escalated"]) for r in records] == [
+        (0, "large", False), (1, "small", False), (1, "large", True)]
+
+
+@pytest.mark.parametrize("content", ["", "   ", [{"type": "text", "text": "x"}]])
+def test_unusable_small_answer_escalates(content):
+    router, small, large = make_router([FakeResponse(content)], [FakeResponse("answer")])
+
+    response, records = router.run([], "hi", 0)
+
+    assert response.content == "answer"
+    assert [(r["tier"], r["escalated"]) for r in records] == [("small", False), ("large", True)]
+    assert [r["latency"] for r in records] == [pytest.approx(0.1), pytest.approx(2.0)]
+
+
+def test_without_small_model_everything_goes_to_large():
+    large = FakeModel(FakeClock(), 0, [FakeResponse("answer")])
+    router = ModelRouter({"large": large})
+
+    response, records = router.run([], "hi", 3)
+
+    assert [r["tier"] for r in records] == ["large"]
+
+
+def serialize(messages):
+    return json.dumps(messages, sort_keys=True, separators=(",", ":"))
+
+
+def test_consecutive_requests_share_a_byte_prefix():
+    assembler = MessageAssembler()
+    messages = [
+        {"role": "system", "content": "System prompt:\n\nBe brief."},
+        {"role": "user", "content": "list the files"},
+    ]
+
+    first = assembler.assemble(messages, "context 1")
+    assert first[-1]["role"] == "user"
+    assert first[-1]["content"].endswith("context 1")
+    assert "context 1" not in messages[-1]["content"]
+    assert not assembler.check_prefix("large", first)
+
+    messages += [
+        {"role": "assistant", "content": "", "tool_calls": []},
+        {"role": "tool", "content": "[]", "name": "list_files", "tool_call_id": "1"},
+    ]
+    second = assembler.assemble(messages, "context 2")
+    assert second[-1]["role"] == "tool"
+    assert assembler.check_prefix("large", second)
+    assert serialize(second).startswith(serialize(first[:-1])[:-1])
+
+    messages[0] = {"role": "system", "content": "System prompt:\n\nBe verbose."}
+    third = assembler.assemble(messages, "context 2")
+    assert not assembler.check_prefix("large", third)